@@ -1,107 +1,226 @@
 import os
-import time
 import re
+import sys
+import types
+import time
+import queue
+import json
+import hashlib
+import asyncio
+import threading
+import collections
+import itertools
 from dotenv import load_dotenv
-from langchain.sql_database import SQLDatabase
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.chains import create_sql_query_chain
 from langchain.prompts import PromptTemplate
-from langchain.memory import ConversationBufferMemory
+from langchain_core.output_parsers import StrOutputParser
+from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable, DeadlineExceeded
+import sqlglot
+from sqlglot import exp
+from tenacity import retry, wait_exponential_jitter, retry_if_exception_type, stop_after_attempt
 import mysql.connector
+import mysql.connector.pooling
+from mysql.connector import errorcode
 import streamlit as st
 import logging
-from functools import lru_cache
-
-# Set up logging
-logging.basicConfig(filename='app.log', level=logging.INFO)
+import logging.handlers
+import atexit
+from cachetools import cached, LRUCache
+from contextlib import closing, contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from decimal import Decimal
+
+# Registry for objects that must live as long as the process. Streamlit re-executes this
+# script in a fresh namespace on every rerun and "Clear cache" drops st.cache_resource
+# entries, so threads, queues and quotas are kept on a module in sys.modules instead
+_process_registry = sys.modules.setdefault("_school_bot_process", types.ModuleType("_school_bot_process"))
+vars(_process_registry).setdefault("lock", threading.RLock())
+vars(_process_registry).setdefault("objects", {})
+
+def process_singleton(factory):
+    def get():
+        with _process_registry.lock:
+            if factory.__name__ not in _process_registry.objects:
+                _process_registry.objects[factory.__name__] = factory()
+            return _process_registry.objects[factory.__name__]
+    return get
+
+# Set up logging; records are queued and written to app.log on a background thread so
+# request handling never blocks on disk IO (set up once per process, not per rerun)
+@process_singleton
+def setup_logging():
+    log_queue = queue.Queue(-1)
+    file_handler = logging.FileHandler('app.log')
+    file_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
 
 # Load environment variables
 load_dotenv()
 
-# Initialize MySQL connection
+# Server-side cap on SELECT run time; bounds queries that pass validation but are slow by
+# design (SLEEP, BENCHMARK, GET_LOCK) or by plan
+MAX_EXECUTION_MS = 5000
+
+# MySQL connection settings. init_command runs once per physical connection (pooled
+# connections keep their session, as pool_reset_session is off), not once per query
+db_config = {
+    "user": os.getenv("MYSQL_USER"),
+    "password": os.getenv("MYSQL_PASSWORD"),
+    "host": os.getenv("MYSQL_HOST"),
+    "database": os.getenv("MYSQL_DATABASE"),
+    "init_command": f"SET SESSION max_execution_time = {MAX_EXECUTION_MS}"
+}
+
+# Initialize MySQL connection pool (built once per process, shared across reruns and sessions)
+@st.cache_resource
+def get_db_pool():
+    # The driver uses its C extension (libmysqlclient) when installed, which fetches rows
+    # much faster; make a silent fallback to the pure-Python protocol visible
+    if not mysql.connector.HAVE_CEXT:
+        logging.warning("MySQL C extension not available; falling back to the pure-Python driver")
+    return mysql.connector.pooling.MySQLConnectionPool(
+        pool_name="school",
+        pool_size=8,
+        pool_reset_session=False,
+        **db_config
+    )
+
 def get_db_connection():
     try:
-        return mysql.connector.connect(
-            user=os.getenv("MYSQL_USER"),
-            password=os.getenv("MYSQL_PASSWORD"),
-            host=os.getenv("MYSQL_HOST"),
-            database=os.getenv("MYSQL_DATABASE")
-        )
+        return get_db_pool().get_connection()
+    except mysql.connector.Error as e:
+        # Pool unavailable or exhausted; fall back to a direct connection
+        logging.warning(f"Connection pool unavailable, connecting directly: {str(e)}")
+    try:
+        return mysql.connector.connect(**db_config)
     except mysql.connector.Error as e:
         logging.error(f"Database connection failed: {str(e)}")
         return None
 
-# Initialize LangChain components
-db_uri = f"mysql+mysqlconnector://{os.getenv('MYSQL_USER')}:{os.getenv('MYSQL_PASSWORD')}@{os.getenv('MYSQL_HOST')}/{os.getenv('MYSQL_DATABASE')}"
-try:
-    db = SQLDatabase.from_uri(db_uri)
-except Exception as e:
-    logging.error(f"Failed to initialize SQLDatabase: {str(e)}")
-    st.error(f"Database connection error: {str(e)}")
-    exit(1)
-
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", google_api_key=os.getenv("GOOGLE_API_KEY"))
-
-# Define database schema
+# Initialize LangChain components (cached so client setup runs once per process).
+# Built-in client retries are disabled; call_llm below is the only retry layer.
+@st.cache_resource
+def get_llm():
+    return ChatGoogleGenerativeAI(model="gemini-1.5-flash", google_api_key=os.getenv("GOOGLE_API_KEY"), max_retries=1)
+
+# Separate client for SQL generation so Gemini is constrained to JSON output
+@st.cache_resource
+def get_sql_llm():
+    return ChatGoogleGenerativeAI(
+        model="gemini-1.5-flash",
+        google_api_key=os.getenv("GOOGLE_API_KEY"),
+        response_mime_type="application/json",
+        max_retries=1
+    )
+
+# Client-side rate limit shared by all sessions, sized to the Gemini Flash RPM quota. The
+# limiter is process-wide: a fresh one after a cache clear would hand out a full minute's
+# budget while the old slots are still in use
+GEMINI_RPM = 15
+
+@process_singleton
+def get_rate_limiter():
+    return threading.Semaphore(GEMINI_RPM)
+
+@st.cache_resource
+def get_llm_call_stats():
+    return collections.Counter()
+
+def acquire_llm_slot():
+    limiter = get_rate_limiter()
+    limiter.acquire()
+    # Each slot is handed back one minute after it was taken
+    timer = threading.Timer(60, limiter.release)
+    timer.daemon = True
+    timer.start()
+
+def record_llm_call(outcome):
+    stats = get_llm_call_stats()
+    stats[outcome] += 1
+    logging.info(f"Gemini calls: {dict(stats)}")
+
+# Function to make a rate-limited Gemini call, retrying quota and availability errors
+@retry(
+    wait=wait_exponential_jitter(initial=1, max=30),
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception_type((ResourceExhausted, ServiceUnavailable, DeadlineExceeded)),
+    reraise=True
+)
+def call_llm(fn, *args):
+    acquire_llm_slot()
+    try:
+        result = fn(*args)
+    except ResourceExhausted:
+        record_llm_call("429")
+        raise
+    except ServiceUnavailable:
+        record_llm_call("503")
+        raise
+    except DeadlineExceeded:
+        record_llm_call("504")
+        raise
+    record_llm_call("success")
+    return result
+
+# Function to start a response stream; the first chunk is fetched eagerly so that
+# request errors surface here, inside the retry policy
+def open_llm_stream(prompt):
+    stream = get_llm().stream(prompt)
+    first = next(stream, None)
+    return stream if first is None else itertools.chain([first], stream)
+
+# Define database schema (compact notation to keep the prompt small)
 schema_info = """
-Table: students
-- roll_no: INT, PRIMARY KEY
-- first_name: VARCHAR(100), NOT NULL
-- last_name: VARCHAR(100), NOT NULL
-- age: TINYINT UNSIGNED, NOT NULL
-- class_id: INT, FOREIGN KEY to classes(class_id)
-- section_id: INT, FOREIGN KEY to sections(section_id)
-- scholarship_id: INT, FOREIGN KEY to scholarships(scholarship_id), NULLABLE
-- bank_account_id: INT, FOREIGN KEY to bankdetails(bank_account_id), NULLABLE
-
-Table: parents
-- parent_id: INT, PRIMARY KEY
-- student_roll_no: INT, FOREIGN KEY to students(roll_no)
-- parent_name: VARCHAR(200), NOT NULL
-- relation: VARCHAR(50), NOT NULL
-
-Table: subjects
-- subject_id: INT, PRIMARY KEY
-- subject_name: VARCHAR(100), NOT NULL
-
-Table: scholarships
-- scholarship_id: INT, PRIMARY KEY
-- scholarship_name: VARCHAR(100), NOT NULL
-- amount: DECIMAL(10,2), NOT NULL
-
-Table: marks
-- mark_id: INT, PRIMARY KEY
-- student_roll_no: INT, FOREIGN KEY to students(roll_no)
-- subject_id: INT, FOREIGN KEY to subjects(subject_id)
-- marks_obtained: DECIMAL(5,2), NOT NULL
-
-Table: bankdetails
-- bank_account_id: INT, PRIMARY KEY
-- student_roll_no: INT, FOREIGN KEY to students(roll_no)
-- bank_name: VARCHAR(100), NOT NULL
-- account_number: VARCHAR(30), NOT NULL
-- ifsc_code: VARCHAR(20), NOT NULL
-
-Table: classes
-- class_id: INT, PRIMARY KEY
-- class_name: VARCHAR(50), NOT NULL
-- section_id: INT, FOREIGN KEY to sections(section_id)
-
-Table: sections
-- section_id: INT, PRIMARY KEY
-- section_name: CHAR(1), NOT NULL
+students(roll_no PK, first_name, last_name, age, class_id->classes, section_id->sections, scholarship_id->scholarships NULL, bank_account_id->bankdetails NULL)
+parents(parent_id PK, student_roll_no->students.roll_no, parent_name, relation)
+subjects(subject_id PK, subject_name)
+scholarships(scholarship_id PK, scholarship_name, amount DECIMAL)
+marks(mark_id PK, student_roll_no->students.roll_no, subject_id->subjects, marks_obtained DECIMAL)
+bankdetails(bank_account_id PK, student_roll_no->students.roll_no, bank_name, account_number, ifsc_code)
+classes(class_id PK, class_name, section_id->sections)
+sections(section_id PK, section_name CHAR(1))
+"""
+
+# Instructions shared by the single-question and batch SQL prompts
+sql_instructions = """
+    You are a MySQL expert. Given user questions and the database schema, create a syntactically correct MySQL query for each question to retrieve the relevant data. Use JOINs for related tables, avoid subqueries where possible, and limit results to the question's row limit for performance.
+    For each query, also write a one-sentence, plain-English answer template to use when the query returns a single row, with Python format placeholders named exactly after the selected columns or aliases, e.g. {{"sql": "SELECT first_name, marks_obtained FROM ...", "answer_template": "The student {{first_name}} scored {{marks_obtained}}."}}. The SQL must be plain text, without any Markdown or code blocks (```sql or ```).
 """
 
 # Custom prompt for SQL query generation
+# Static instructions and schema come first so every request shares the same prompt prefix;
+# only the row limit and question vary per call
 sql_prompt = PromptTemplate(
-    input_variables=["input", "top_k", "table_info"],
-    template="""
-    You are a MySQL expert. Given a user question and the database schema, create a syntactically correct MySQL query to retrieve the relevant data. Use JOINs for related tables, avoid subqueries where possible, and limit results to {top_k} for performance. Return ONLY the SQL query as plain text, without any Markdown, code blocks (```sql or ```), or additional text.
+    input_variables=["question", "top_k", "table_info"],
+    template=sql_instructions + """
+    Return ONLY a JSON object of the form {{"sql": "<query>", "answer_template": "<template>"}}.
 
-    User question: {input}
     Database schema: {table_info}
 
-    SQL Query:
+    Row limit: {top_k}
+    User question: {question}
+
+    JSON:
+    """
+)
+
+# Custom prompt for generating SQL for several questions in a single call
+batch_sql_prompt = PromptTemplate(
+    input_variables=["questions", "table_info"],
+    template=sql_instructions + """
+    Return ONLY a JSON array with one object per question, each of the form {{"index": <the question's index>, "sql": "<query>", "answer_template": "<template>"}}.
+
+    Database schema: {table_info}
+
+    Questions: {questions}
+
+    JSON:
     """
 )
 
@@ -119,95 +238,454 @@ response_prompt = PromptTemplate(
     """
 )
 
-# Initialize SQL query chain with schema
-sql_chain = create_sql_query_chain(llm=llm, db=db, prompt=sql_prompt.partial(table_info=schema_info), k=5)
-
-# Initialize conversation memory
-memory = ConversationBufferMemory(input_key="input", memory_key="history")
-
-# Cache for frequent queries
-@lru_cache(maxsize=100)
-def cached_sql_query(sanitized_input, top_k):
-    return sql_chain.invoke({"question": sanitized_input, "top_k": top_k})
+# Plain format string for response_prompt, rendered with str.format on each turn
+_RESP_FMT = response_prompt.template
+
+# Persistent event loop for generate_response. Its blocking steps (cached SQL lookup,
+# query execution, opening the response stream) run via asyncio.to_thread, so keeping one
+# loop reuses its default thread pool across turns; asyncio.run() per turn would create
+# and shut down a new loop and executor each time. Process-wide so a cache clear never
+# strands the running loop and its thread
+@process_singleton
+def get_event_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def run_async(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+# Schema-bound SQL prompts, partialed once per process
+@st.cache_resource
+def get_sql_prompt():
+    return sql_prompt.partial(table_info=schema_info)
+
+@st.cache_resource
+def get_batch_sql_prompt():
+    return batch_sql_prompt.partial(table_info=schema_info)
+
+# Initialize SQL query chain with schema; only the question and row limit are sent per call
+@st.cache_resource
+def get_sql_chain():
+    return get_sql_prompt() | get_sql_llm() | StrOutputParser()
+
+@st.cache_resource
+def get_batch_sql_chain():
+    return get_batch_sql_prompt() | get_sql_llm() | StrOutputParser()
+
+# Coalesces SQL-generation requests from concurrent sessions into a single Gemini call.
+# A request that arrives while the generator is idle is sent on its own without waiting.
+class QueueingSqlGenerator:
+    def __init__(self, max_batch=4, max_wait=0.08):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_batch)
+        threading.Thread(target=self._drain, daemon=True).start()
+
+    def generate(self, question, top_k):
+        future = Future()
+        self.requests.put((question, top_k, future))
+        return future.result()
+
+    def _drain(self):
+        while True:
+            batch = [self.requests.get()]
+            if self.in_flight or not self.requests.empty():
+                deadline = time.monotonic() + self.max_wait
+                while len(batch) < self.max_batch:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(self.requests.get(timeout=timeout))
+                    except queue.Empty:
+                        break
+            with self.lock:
+                self.in_flight += 1
+            self.executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        try:
+            self._resolve(batch)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def _resolve(self, batch):
+        if len(batch) > 1:
+            try:
+                plans = self._generate_batch(batch)
+            except (ValueError, TypeError, KeyError) as e:
+                logging.warning(f"Batched SQL generation returned unusable output, falling back to single calls: {str(e)}")
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                return
+            else:
+                for (_, _, future), plan in zip(batch, plans):
+                    future.set_result(plan)
+                return
+        for question, top_k, future in batch:
+            try:
+                future.set_result(call_llm(get_sql_chain().invoke, {"question": question, "top_k": top_k}))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _generate_batch(self, batch):
+        questions = json.dumps([
+            {"index": index, "question": question, "row_limit": top_k}
+            for index, (question, top_k, _) in enumerate(batch)
+        ])
+        raw = call_llm(get_batch_sql_chain().invoke, {"questions": questions})
+        plans = json.loads(raw)
+        # Plans are matched to questions by the echoed index, never by position; any
+        # missing, duplicated or unknown index rejects the whole batch
+        plans_by_index = {plan["index"]: plan for plan in plans}
+        if len(plans) != len(batch) or set(plans_by_index) != set(range(len(batch))):
+            raise ValueError(f"Expected SQL plans for indexes 0-{len(batch) - 1}, got: {raw[:200]}")
+        # Re-serialize each plan so callers see the same format as a single-question call
+        return [
+            json.dumps({key: value for key, value in plans_by_index[index].items() if key != "index"})
+            for index in range(len(batch))
+        ]
+
+# Process-wide so a cache clear never leaves a drain thread and executor running unused
+@process_singleton
+def get_sql_generator():
+    return QueueingSqlGenerator()
+
+# Cache for frequent queries, persisted to disk so it survives restarts. Streamlit does not
+# apply a TTL to disk-persisted caches, so entries are keyed on a hash of the schema and
+# prompts; changing either starts a fresh set of entries.
+PROMPT_VERSION = hashlib.sha256(
+    (schema_info + sql_prompt.template + batch_sql_prompt.template).encode()
+).hexdigest()[:16]
+
+def normalize_question(question):
+    # Case and whitespace differences should hit the same cache entry
+    return " ".join(question.lower().split())
+
+@st.cache_data(max_entries=1000, persist="disk", show_spinner=False)
+def cached_sql_query(question_key, top_k, prompt_version, _question):
+    # Keyed on the normalized question; the leading underscore keeps the original out of the key
+    sql_plan = get_sql_generator().generate(_question, top_k)
+    # Raise on plans that cannot be used, including ones the server rejects at EXPLAIN
+    # (unknown columns, full scans of large tables); st.cache_data does not store
+    # exceptions, so a bad translation is never persisted
+    sql_query, _ = parse_sql_plan(sql_plan)
+    query = validate_query(clean_sql_query(sql_query))
+    with db_transaction() as conn:
+        check_statement(conn, query)
+    return sql_plan
+
+# Precompiled patterns for input sanitization and SQL cleanup
+_SANITIZE_RE = re.compile(r'\b(?:SELECT|INSERT|UPDATE|DELETE|DROP|ALTER|CREATE)\b|--|;|\*', re.IGNORECASE)
+_FENCE_RE = re.compile(r'^```(?:sql)?\s*|\s*```$', re.IGNORECASE)
 
 # Function to sanitize user input
 def sanitize_input(user_input):
-    dangerous_patterns = [r'\b(SELECT|INSERT|UPDATE|DELETE|DROP|ALTER|CREATE)\b', r'--', r';', r'\*']
-    sanitized = user_input
-    for pattern in dangerous_patterns:
-        sanitized = re.sub(pattern, '', sanitized, flags=re.IGNORECASE)
-    return sanitized
+    return _SANITIZE_RE.sub('', user_input)
 
 # Function to clean SQL query
 def clean_sql_query(query):
-    # Remove Markdown code block markers and surrounding whitespace
-    cleaned = re.sub(r'```sql\s*|\s*```', '', query, flags=re.IGNORECASE)
-    cleaned = cleaned.strip()
-    return cleaned
+    # Remove Markdown code block markers and surrounding whitespace; the model is asked for
+    # bare SQL, so skip the regex when there is no fence
+    query = query.strip()
+    return _FENCE_RE.sub('', query).strip() if "```" in query else query
+
+# Function to summarize query results for the response prompt: the first k rows,
+# without NULL columns, plus a count of the rows left out
+def summarize_results(rows, k=5):
+    head = [{key: value for key, value in row.items() if value is not None} for row in rows[:k]]
+    tail = len(rows) - k
+    return json.dumps(head, default=str) + (f"\n...and {tail} more rows" if tail > 0 else "")
+
+# Function to split the model's JSON output into the SQL query and answer template
+def parse_sql_plan(raw):
+    try:
+        plan = json.loads(raw)
+        sql_query, answer_template = plan["sql"], plan.get("answer_template")
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise ValueError(f"SQL generation did not return a JSON plan: {raw[:200]}")
+    if not isinstance(sql_query, str):
+        raise ValueError(f"SQL generation returned no SQL query: {raw[:200]}")
+    return sql_query, answer_template if isinstance(answer_template, str) else None
+
+# Function to fill the answer template from a single-row result; rows with NULL columns
+# are left to the LLM so "None" never appears in an answer
+def render_answer(answer_template, results):
+    if not answer_template or len(results) != 1 or None in results[0].values():
+        return None
+    try:
+        return answer_template.format_map(results[0])
+    except (KeyError, IndexError, ValueError, AttributeError, TypeError):
+        return None
+
+# Literal values inlined by the LLM: quoted strings anywhere, and numbers directly
+# after a comparison operator or LIMIT/OFFSET (whole numbers only, so 1.5e3 stays inline).
+# Backtick-quoted identifiers are matched first so that quotes inside them are left alone.
+_SQL_LITERAL_RE = re.compile(
+    r'''(`(?:[^`]|``)*`)|'((?:[^'\\]|'')*)'|"((?:[^"\\]|"")*)"|((?:[=<>]|\bLIMIT|\bOFFSET)\s*)(-?\d+(?:\.\d+)?)(?![\w.])''',
+    re.IGNORECASE
+)
+
+# Cache of query text -> (statement template, bind parameters), shared across sessions
+@st.cache_resource
+def get_statement_cache():
+    return LRUCache(maxsize=64)
+
+@st.cache_resource
+def get_statement_cache_lock():
+    return threading.Lock()
+
+# Function to split a generated query into a prepared-statement template and its parameters
+@cached(get_statement_cache(), lock=get_statement_cache_lock())
+def parameterize_query(query):
+    if "\\" in query or "?" in query:
+        return None  # Escapes and existing placeholders are not handled
+    params = []
+
+    def bind(match):
+        identifier, single, double, prefix, number = match.groups()
+        if identifier is not None:
+            return identifier
+        if number is not None:
+            params.append(Decimal(number) if "." in number else int(number))
+            return f"{prefix}?"
+        if single is not None:
+            params.append(single.replace("''", "'"))
+        else:
+            params.append(double.replace('""', '"'))
+        return "?"
+
+    template = _SQL_LITERAL_RE.sub(bind, query)
+    return (template, tuple(params)) if params else None
+
+# Guardrail limits for generated SQL
+MAX_RESULT_ROWS = 100
+LARGE_TABLE_ROWS = 10000
+
+# Raised when generated SQL fails the read-only or query-plan guardrail
+class QueryRejectedError(Exception):
+    pass
+
+# Function to check that generated SQL is a single bounded SELECT, adding a LIMIT if missing
+def validate_query(query):
+    try:
+        statements = [statement for statement in sqlglot.parse(query, read="mysql") if statement is not None]
+    except sqlglot.errors.SqlglotError as e:
+        raise QueryRejectedError(f"Could not parse the query: {str(e)}")
+    if len(statements) != 1 or not isinstance(statements[0], exp.Select):
+        raise QueryRejectedError("Only a single SELECT statement is allowed.")
+    select = statements[0]
+    # FOR UPDATE / FOR SHARE / LOCK IN SHARE MODE take row locks, and SELECT ... INTO
+    # writes to a table or variable, anywhere in the query
+    if any(node.args.get("locks") for node in select.find_all(exp.Select)):
+        raise QueryRejectedError("Locking reads are not allowed.")
+    if any(node.args.get("into") for node in select.find_all(exp.Select)):
+        raise QueryRejectedError("SELECT ... INTO is not allowed.")
+    for join in select.find_all(exp.Join):
+        # A join with no ON/USING and no WHERE filter is a full cartesian product;
+        # NATURAL joins carry an implicit condition on the shared columns
+        if (
+            join.args.get("method") != "NATURAL"
+            and not join.args.get("on")
+            and not join.args.get("using")
+            and not join.find_ancestor(exp.Select).args.get("where")
+        ):
+            raise QueryRejectedError("Joins must have a join condition.")
+    if select.args.get("limit") is None:
+        # Add the LIMIT on the AST so it lands before any trailing clause or comment
+        query = select.limit(MAX_RESULT_ROWS).sql(dialect="mysql")
+    return query
+
+# Function to reject query plans that fully scan a large table
+def check_query_plan(plan):
+    for row in plan:
+        if row.get("type") == "ALL" and (row.get("rows") or 0) > LARGE_TABLE_ROWS:
+            raise QueryRejectedError(f"The query would scan all of table {row.get('table')} without an index.")
+
+# Context manager for a read-only unit of work on a (pooled) connection. The transaction
+# is always rolled back so that, with pool_reset_session=False, a connection never carries
+# an open snapshot into its next checkout; close() then returns it to the pool.
+@contextmanager
+def db_transaction():
+    conn = get_db_connection()
+    if not conn:
+        raise mysql.connector.InterfaceError(msg="Failed to connect to the database.")
+    try:
+        yield conn
+    finally:
+        try:
+            conn.rollback()
+        except mysql.connector.Error as e:
+            logging.warning(f"Rollback failed: {str(e)}")
+        conn.close()
+
+# Function to run a statement on a dictionary cursor and fetch all rows
+def fetch_all(conn, operation, params=None):
+    with closing(conn.cursor(dictionary=True)) as cursor:
+        cursor.execute(operation, params)
+        return cursor.fetchall()
+
+# Prepared cursors kept per physical connection, keyed by statement template. Pooled
+# connections outlive each checkout and pool_reset_session=False keeps their server-side
+# statements, so a repeated template is executed without another PREPARE.
+PREPARED_CURSORS_PER_CONNECTION = 16
+
+class PreparedCursorCache(LRUCache):
+    # Evicted cursors are closed so their server-side statements are released
+    def popitem(self):
+        key, (template, cursor) = super().popitem()
+        close_cursor(cursor)
+        return key, (template, cursor)
+
+def close_cursor(cursor):
+    try:
+        cursor.close()
+    except mysql.connector.Error as e:
+        logging.warning(f"Closing prepared cursor failed: {str(e)}")
+
+# Function to run a statement template on a cached prepared cursor and fetch all rows
+def fetch_prepared(conn, template, params):
+    # A pooled connection wraps the physical connection, which is what the cursors belong to
+    cnx = getattr(conn, "_cnx", conn)
+    cursors = getattr(cnx, "prepared_cursors", None)
+    if cursors is None:
+        cursors = cnx.prepared_cursors = PreparedCursorCache(maxsize=PREPARED_CURSORS_PER_CONNECTION)
+    if template not in cursors:
+        cursors[template] = (template, conn.cursor(prepared=True, dictionary=True))
+    # The cursor re-prepares only when given a different statement object, so always pass
+    # back the exact template string it was first executed with
+    cached_template, cursor = cursors[template]
+    try:
+        cursor.execute(cached_template, params)
+        return cursor.fetchall()
+    except mysql.connector.Error:
+        del cursors[template]
+        close_cursor(cursor)
+        raise
+
+# Server errors the unprepared query can avoid: a placeholder where MySQL needs an inline
+# literal, or a statement the binary protocol does not support
+PREPARED_FALLBACK_ERRNOS = {
+    errorcode.ER_PARSE_ERROR,
+    errorcode.ER_WRONG_ARGUMENTS,
+    errorcode.ER_UNSUPPORTED_PS
+}
+
+# Statement shapes whose EXPLAIN plan has already passed; each shape is only explained once
+@st.cache_resource
+def get_checked_plans():
+    return LRUCache(maxsize=256)
+
+@st.cache_resource
+def get_checked_plans_lock():
+    return threading.Lock()
+
+@cached(get_checked_plans(), key=lambda conn, shape, query: shape, lock=get_checked_plans_lock())
+def ensure_query_plan(conn, shape, query):
+    check_query_plan(fetch_all(conn, f"EXPLAIN {query}"))
+    return True
+
+# Function to split a validated query into its prepared statement (or None) and check its plan
+def check_statement(conn, query):
+    statement = parameterize_query(query)
+    ensure_query_plan(conn, statement[0] if statement else query, query)
+    return statement
 
 # Function to execute SQL query safely
 def execute_query(query):
     try:
-        conn = get_db_connection()
-        if not conn:
-            return "Failed to connect to the database."
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(query)
-        results = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        return results
+        query = validate_query(query)
+        with db_transaction() as conn:
+            statement = check_statement(conn, query)
+            if statement:
+                try:
+                    return fetch_prepared(conn, *statement)
+                except (mysql.connector.Error, ValueError) as e:
+                    # Anything other than a prepare failure (e.g. an unknown column) would
+                    # fail the same way unprepared, so it is raised instead of run twice
+                    if not isinstance(e, ValueError) and e.errno not in PREPARED_FALLBACK_ERRNOS:
+                        raise
+                    logging.warning(f"Prepared execution failed, running query directly: {str(e)}")
+            return fetch_all(conn, query)
+    except QueryRejectedError as e:
+        logging.warning(f"Query rejected: {query}\nReason: {str(e)}")
+        return f"Query rejected: {str(e)}"
     except mysql.connector.Error as e:
         logging.error(f"Query failed: {query}\nError: {str(e)}")
         return f"Error executing query: {str(e)}"
 
-# Function to generate response with retry logic
-def generate_response(user_input):
+# Function to generate response
+async def generate_response(user_input, history):
     try:
         sanitized_input = sanitize_input(user_input)
-        max_retries = 3
-        retry_delay = 6  # seconds, based on Gemini API rate limit error
 
-        for attempt in range(max_retries):
-            try:
-                sql_query = cached_sql_query(sanitized_input, 5)
-                cleaned_query = clean_sql_query(sql_query)
-                logging.info(f"Executing query: {cleaned_query}")
-                results = execute_query(cleaned_query)
-                if isinstance(results, str):
-                    return results  # Error message
-                results_str = str(results) if results else "No results found."
-
-                # Update conversation memory
-                memory.save_context({"input": sanitized_input}, {"output": results_str})
-
-                # Get conversation history
-                history = memory.load_memory_variables({})["history"]
-
-                # Generate response using the LLM directly with response_prompt
-                response = llm.invoke(
-                    response_prompt.format(query=cleaned_query, results=results_str, history=history)
-                ).content
-                return response
-            except Exception as e:
-                if "429" in str(e) and attempt < max_retries - 1:
-                    logging.warning(f"Rate limit exceeded, retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                else:
-                    logging.error(f"Response generation failed: {str(e)}")
-                    return f"Error generating response: {str(e)}"
+        # Cached lookup is synchronous; run it off the event loop
+        sql_plan = await asyncio.to_thread(
+            cached_sql_query, normalize_question(sanitized_input), 5, PROMPT_VERSION, sanitized_input
+        )
+        sql_query, answer_template = parse_sql_plan(sql_plan)
+        cleaned_query = clean_sql_query(sql_query)
+        logging.info(f"Executing query: {cleaned_query}")
+        results = await asyncio.to_thread(execute_query, cleaned_query)
+        if isinstance(results, str):
+            return results  # Error message
+        results_str = summarize_results(results) if results else "No results found."
+
+        # Conversation history is bounded to the last few turns
+        turn = f"User: {sanitized_input}\nAssistant: {results_str[:500]}"
+
+        # Single-row lookups are answered from the template without a second LLM call
+        response = render_answer(answer_template, results)
+        if response is None:
+            # Stream the response from the LLM using response_prompt
+            history_str = "\n".join([*history, turn])
+            response = await asyncio.to_thread(
+                call_llm,
+                open_llm_stream,
+                _RESP_FMT.format(query=cleaned_query, results=results_str, history=history_str)
+            )
+        history.append(turn)
+        return response
+    except QueryRejectedError as e:
+        logging.warning(f"Generated query rejected: {str(e)}")
+        return f"Query rejected: {str(e)}"
     except Exception as e:
-        logging.error(f"Unexpected error: {str(e)}")
+        logging.error(f"Response generation failed: {str(e)}")
         return f"Error generating response: {str(e)}"
 
+# Function to yield streamed response text, reporting failures inline
+def stream_response(response_stream):
+    try:
+        for chunk in response_stream:
+            yield chunk.content
+    except Exception as e:
+        logging.error(f"Response streaming failed: {str(e)}")
+        yield f"Error generating response: {str(e)}"
+
 # Streamlit frontend
 def main():
     st.title("School Database Q&A Bot (Powered by Gemini)")
     st.write("Ask about students, parents, marks, scholarships, or classes, and get answers in plain English!")
+
+    # Build shared resources here so worker threads only ever hit the cache
+    try:
+        get_sql_chain()
+        get_batch_sql_chain()
+        get_sql_generator()
+    except Exception as e:
+        logging.error(f"Failed to initialize SQL chain: {str(e)}")
+        st.error(f"Initialization error: {str(e)}")
+        st.stop()
     
     if "messages" not in st.session_state:
         st.session_state.messages = []
+    st.session_state.setdefault("history_deque", collections.deque(maxlen=6))
     
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
@@ -222,9 +700,13 @@ def main():
         
         with st.chat_message("assistant"):
             with st.spinner("Generating response..."):
-                response = generate_response(user_input)
+                response = run_async(generate_response(user_input, st.session_state.history_deque))
+            if isinstance(response, str):
                 st.markdown(response)
-                st.session_state.messages.append({"role": "assistant", "content": response})
+            else:
+                response = st.write_stream(stream_response(response))
+            st.session_state.messages.append({"role": "assistant", "content": response})
 
 if __name__ == "__main__":
+    setup_logging()
     main()
\ No newline at end of file
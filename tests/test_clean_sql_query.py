@@ -0,0 +1,19 @@
+import pytest
+
+from app import clean_sql_query
+
+
+@pytest.mark.parametrize("raw", [
+    "SELECT * FROM students",
+    "  SELECT * FROM students\n",
+    "```sql\nSELECT * FROM students\n```",
+    "```SQL\nSELECT * FROM students\n```",
+    "```\nSELECT * FROM students\n```",
+    "\n```sql SELECT * FROM students```  ",
+])
+def test_fences_and_whitespace_are_removed(raw):
+    assert clean_sql_query(raw) == "SELECT * FROM students"
+
+
+def test_query_text_is_left_alone():
+    assert clean_sql_query("SELECT 'sql' AS kind FROM students") == "SELECT 'sql' AS kind FROM students"
@@ -0,0 +1,65 @@
+from decimal import Decimal
+
+from app import parameterize_query
+
+
+def test_string_and_number_literals_become_parameters():
+    assert parameterize_query(
+        "SELECT first_name FROM students s JOIN marks m ON s.roll_no = m.student_roll_no "
+        "WHERE s.first_name = 'Riya' AND m.marks_obtained >= 85.5 LIMIT 5"
+    ) == (
+        "SELECT first_name FROM students s JOIN marks m ON s.roll_no = m.student_roll_no "
+        "WHERE s.first_name = ? AND m.marks_obtained >= ? LIMIT ?",
+        ("Riya", Decimal("85.5"), 5),
+    )
+
+
+def test_doubled_quotes_are_unescaped():
+    assert parameterize_query("SELECT * FROM parents WHERE parent_name LIKE '%O''Brien%'") == (
+        "SELECT * FROM parents WHERE parent_name LIKE ?",
+        ("%O'Brien%",),
+    )
+    assert parameterize_query('SELECT * FROM parents WHERE relation = "Fa""ther"') == (
+        "SELECT * FROM parents WHERE relation = ?",
+        ('Fa"ther',),
+    )
+
+
+def test_backtick_identifiers_are_left_alone():
+    assert parameterize_query("SELECT `it's` FROM t WHERE a = 'x'") == (
+        "SELECT `it's` FROM t WHERE a = ?",
+        ("x",),
+    )
+    assert parameterize_query("SELECT `a``b` FROM t WHERE `n'` = 3") == (
+        "SELECT `a``b` FROM t WHERE `n'` = ?",
+        (3,),
+    )
+
+
+def test_numbers_outside_comparisons_are_kept():
+    assert parameterize_query("SELECT class_id FROM classes ORDER BY 1 LIMIT 5") == (
+        "SELECT class_id FROM classes ORDER BY 1 LIMIT ?",
+        (5,),
+    )
+    assert parameterize_query("SELECT t1.age FROM students t1 WHERE t1.age IN (10, 11)") is None
+
+
+def test_negative_numbers_are_bound():
+    assert parameterize_query("SELECT * FROM scholarships WHERE amount > -1") == (
+        "SELECT * FROM scholarships WHERE amount > ?",
+        (-1,),
+    )
+
+
+def test_numbers_are_not_split():
+    assert parameterize_query("SELECT * FROM scholarships WHERE amount <= 1.5e3") is None
+    assert parameterize_query("SELECT * FROM scholarships WHERE amount <= 1.5e3 LIMIT 5") == (
+        "SELECT * FROM scholarships WHERE amount <= 1.5e3 LIMIT ?",
+        (5,),
+    )
+
+
+def test_unsupported_queries_are_not_parameterized():
+    assert parameterize_query("SELECT * FROM students WHERE first_name = 'O\\'Brien'") is None
+    assert parameterize_query("SELECT * FROM students WHERE first_name = ?") is None
+    assert parameterize_query("SELECT COUNT(*) FROM students") is None
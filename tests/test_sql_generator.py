@@ -0,0 +1,91 @@
+import json
+from concurrent.futures import Future
+
+import pytest
+
+import app
+from app import QueueingSqlGenerator
+
+
+class StubChain:
+    def __init__(self, respond):
+        self.respond = respond
+        self.calls = []
+
+    def invoke(self, inputs):
+        self.calls.append(inputs)
+        return self.respond(inputs)
+
+
+@pytest.fixture
+def chains(monkeypatch):
+    batch_chain = StubChain(lambda inputs: "[]")
+    single_chain = StubChain(lambda inputs: json.dumps({"sql": f"SELECT '{inputs['question']}'"}))
+    monkeypatch.setattr(app, "call_llm", lambda fn, *args: fn(*args))
+    monkeypatch.setattr(app, "get_batch_sql_chain", lambda: batch_chain)
+    monkeypatch.setattr(app, "get_sql_chain", lambda: single_chain)
+    return batch_chain, single_chain
+
+
+def make_batch(*questions):
+    return [(question, 5, Future()) for question in questions]
+
+
+def test_batch_plans_are_matched_by_index(chains):
+    batch_chain, _ = chains
+    batch_chain.respond = lambda inputs: json.dumps([
+        {"index": 1, "sql": "SELECT 'b'"},
+        {"index": 0, "sql": "SELECT 'a'", "answer_template": "{x}"},
+    ])
+    plans = QueueingSqlGenerator()._generate_batch(make_batch("a", "b"))
+    assert [json.loads(plan) for plan in plans] == [
+        {"sql": "SELECT 'a'", "answer_template": "{x}"},
+        {"sql": "SELECT 'b'"},
+    ]
+    assert json.loads(batch_chain.calls[0]["questions"]) == [
+        {"index": 0, "question": "a", "row_limit": 5},
+        {"index": 1, "question": "b", "row_limit": 5},
+    ]
+
+
+@pytest.mark.parametrize("raw", [
+    '[{"index": 0, "sql": "SELECT 1"}]',
+    '[{"index": 0, "sql": "SELECT 1"}, {"index": 0, "sql": "SELECT 2"}]',
+    '[{"index": 0, "sql": "SELECT 1"}, {"index": 2, "sql": "SELECT 2"}]',
+    '[{"index": 0, "sql": "SELECT 1"}, {"index": 1, "sql": "SELECT 2"}, {"index": 1, "sql": "SELECT 3"}]',
+])
+def test_missing_or_duplicate_indexes_are_rejected(chains, raw):
+    batch_chain, _ = chains
+    batch_chain.respond = lambda inputs: raw
+    with pytest.raises(ValueError):
+        QueueingSqlGenerator()._generate_batch(make_batch("a", "b"))
+
+
+@pytest.mark.parametrize("raw", [
+    '{"index": 0, "sql": "SELECT 1"}',
+    '["SELECT 1", "SELECT 2"]',
+    '[{"sql": "SELECT 1"}, {"sql": "SELECT 2"}]',
+    "SELECT 1; SELECT 2",
+])
+def test_unusable_batch_output_falls_back_to_single_calls(chains, raw):
+    batch_chain, single_chain = chains
+    batch_chain.respond = lambda inputs: raw
+    batch = make_batch("a", "b")
+    QueueingSqlGenerator()._resolve(batch)
+    assert [json.loads(future.result())["sql"] for _, _, future in batch] == ["SELECT 'a'", "SELECT 'b'"]
+    assert [call["question"] for call in single_chain.calls] == ["a", "b"]
+
+
+def test_llm_errors_are_raised_to_every_caller(chains):
+    batch_chain, single_chain = chains
+
+    def fail(inputs):
+        raise RuntimeError("quota exceeded")
+
+    batch_chain.respond = fail
+    batch = make_batch("a", "b")
+    QueueingSqlGenerator()._resolve(batch)
+    for _, _, future in batch:
+        with pytest.raises(RuntimeError):
+            future.result()
+    assert single_chain.calls == []
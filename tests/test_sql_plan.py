@@ -0,0 +1,60 @@
+import pytest
+
+from app import parse_sql_plan, render_answer
+
+
+def test_plan_is_split_into_query_and_template():
+    assert parse_sql_plan(
+        '{"sql": "SELECT COUNT(*) AS total FROM students", "answer_template": "There are {total} students."}'
+    ) == ("SELECT COUNT(*) AS total FROM students", "There are {total} students.")
+
+
+def test_missing_or_invalid_template_is_dropped():
+    assert parse_sql_plan('{"sql": "SELECT * FROM students"}') == ("SELECT * FROM students", None)
+    assert parse_sql_plan('{"sql": "SELECT * FROM students", "answer_template": null}') == (
+        "SELECT * FROM students",
+        None,
+    )
+    assert parse_sql_plan('{"sql": "SELECT * FROM students", "answer_template": 3}') == (
+        "SELECT * FROM students",
+        None,
+    )
+
+
+@pytest.mark.parametrize("raw", [
+    "SELECT * FROM students",
+    '["SELECT * FROM students"]',
+    '{"query": "SELECT * FROM students"}',
+    '{"sql": null}',
+    '{"sql": ["SELECT 1"]}',
+])
+def test_unusable_plans_are_rejected(raw):
+    with pytest.raises(ValueError):
+        parse_sql_plan(raw)
+
+
+def test_single_row_fills_the_template():
+    assert render_answer("{first_name} is in class {class_id}.", [{"first_name": "Riya", "class_id": 7}]) == (
+        "Riya is in class 7."
+    )
+
+
+@pytest.mark.parametrize("template, results", [
+    (None, [{"total": 3}]),
+    ("There are {total} students.", []),
+    ("There are {total} students.", [{"total": 3}, {"total": 4}]),
+    ("{first_name} has no parent listed.", [{"first_name": "Riya", "parent_name": None}]),
+])
+def test_other_results_are_left_to_the_llm(template, results):
+    assert render_answer(template, results) is None
+
+
+@pytest.mark.parametrize("template", [
+    "There are {count} students.",
+    "There are {0} students.",
+    "There are {total:%} students.",
+    "There are {total.real.x} students.",
+    "There are {total students.",
+])
+def test_broken_templates_are_left_to_the_llm(template):
+    assert render_answer(template, [{"total": "3"}]) is None
@@ -0,0 +1,30 @@
+import json
+from datetime import date
+from decimal import Decimal
+
+from app import summarize_results
+
+
+def test_small_results_are_kept_whole():
+    rows = [{"first_name": "Riya", "age": 12}, {"first_name": "Aman", "age": 13}]
+    assert summarize_results(rows) == json.dumps(rows)
+
+
+def test_large_results_are_cut_to_the_first_rows():
+    rows = [{"roll_no": n} for n in range(12)]
+    assert summarize_results(rows) == json.dumps(rows[:5]) + "\n...and 7 more rows"
+    assert summarize_results(rows, k=10) == json.dumps(rows[:10]) + "\n...and 2 more rows"
+
+
+def test_null_columns_are_dropped():
+    assert summarize_results([{"first_name": "Riya", "parent_name": None}]) == '[{"first_name": "Riya"}]'
+
+
+def test_database_types_are_serialized():
+    assert summarize_results([{"amount": Decimal("1500.50"), "dob": date(2012, 5, 1)}]) == (
+        '[{"amount": "1500.50", "dob": "2012-05-01"}]'
+    )
+
+
+def test_empty_results():
+    assert summarize_results([]) == "[]"
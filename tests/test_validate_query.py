@@ -0,0 +1,65 @@
+import pytest
+
+from app import QueryRejectedError, validate_query
+
+
+def test_limit_is_added_when_missing():
+    assert validate_query("SELECT * FROM students WHERE age > 12") == "SELECT * FROM students WHERE age > 12 LIMIT 100"
+
+
+def test_existing_limit_is_kept():
+    query = "SELECT * FROM students LIMIT 5"
+    assert validate_query(query) == query
+
+
+def test_limit_is_not_swallowed_by_a_trailing_comment():
+    assert validate_query("SELECT * FROM students -- note") == "SELECT * FROM students /* note */ LIMIT 100"
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM students FOR UPDATE",
+    "SELECT * FROM students FOR SHARE",
+    "SELECT * FROM students LOCK IN SHARE MODE",
+    "SELECT * FROM (SELECT * FROM students FOR UPDATE) AS s",
+])
+def test_locking_reads_are_rejected(query):
+    with pytest.raises(QueryRejectedError):
+        validate_query(query)
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * INTO backup_students FROM students",
+    "SELECT COUNT(*) INTO @total FROM students",
+    "SELECT * FROM (SELECT roll_no INTO @roll FROM students) AS s",
+])
+def test_select_into_is_rejected(query):
+    with pytest.raises(QueryRejectedError):
+        validate_query(query)
+
+
+@pytest.mark.parametrize("query", [
+    "DELETE FROM students",
+    "SELECT 1; DROP TABLE students",
+    "SELECT first_name FROM students UNION SELECT parent_name FROM parents",
+])
+def test_non_select_statements_are_rejected(query):
+    with pytest.raises(QueryRejectedError):
+        validate_query(query)
+
+
+def test_joins_without_a_condition_are_rejected():
+    with pytest.raises(QueryRejectedError):
+        validate_query("SELECT * FROM students, parents")
+    with pytest.raises(QueryRejectedError):
+        validate_query("SELECT * FROM students CROSS JOIN parents")
+
+
+def test_joins_with_a_condition_are_allowed():
+    validate_query("SELECT * FROM students s JOIN parents p ON s.roll_no = p.student_roll_no")
+    validate_query("SELECT * FROM students s, parents p WHERE s.roll_no = p.student_roll_no")
+    validate_query("SELECT * FROM classes NATURAL JOIN sections")
+
+
+def test_unparseable_queries_are_rejected():
+    with pytest.raises(QueryRejectedError):
+        validate_query("SELECT `first_name FROM students")